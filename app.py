@@ -1,11 +1,22 @@
 # dreamcanvas_plus_app.py
 
 import os
+import re
+import json
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import wave
 import streamlit as st
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import BytesIO
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
+from concurrent.futures import ThreadPoolExecutor
+import imageio_ffmpeg
+from tts_utils import voice_wav_bytes
 from dotenv import load_dotenv
 
 load_dotenv()  # Load Hugging Face API token from .env
@@ -14,37 +25,98 @@ HF_TOKEN = os.getenv("HF_TOKEN")
 st.set_page_config(page_title="DreamCanvas+", page_icon="🎨")
 st.title("🎨 DreamCanvas+: AI Story from Kids' Drawings")
 
-os.makedirs("outputs", exist_ok=True)
+# Hosted Hugging Face Inference API by default; point INFERENCE_URL at the
+# local backend (server.py, e.g. http://127.0.0.1:8000) to run models on-box.
+HF_INFERENCE_URL = "https://api-inference.huggingface.co"
+INFERENCE_URL = os.getenv("INFERENCE_URL", HF_INFERENCE_URL).rstrip("/")
+LOCAL_BACKEND = INFERENCE_URL != HF_INFERENCE_URL
+PIPER_VOICE = os.getenv("PIPER_VOICE", "en_US-amy-medium.onnx")
+
+FALLBACK_CAPTION = "a child's drawing"
+CAPTION_MODEL = os.getenv("CAPTION_MODEL", "Salesforce/blip-image-captioning-base")
+STORY_MODEL = os.getenv("STORY_MODEL", "google/flan-t5-base")
+# Piper is only served by the local backend; the hosted API needs a Hub TTS model
+TTS_MODEL = os.getenv("TTS_MODEL", "piper" if LOCAL_BACKEND else "facebook/mms-tts-eng")
+# Explicit decoding settings: the API default stops after ~20 tokens, and
+# plain sampling (no beam search) is plenty for a short kids' story.
+STORY_PARAMETERS = {"max_new_tokens": 200, "num_beams": 1, "do_sample": True, "temperature": 0.9}
+
+CACHE_DIR = os.path.join("outputs", ".cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
 
 
 # ---------------------- Hugging Face Helpers ---------------------- #
 
-def hf_text_generation(prompt, model="gpt2"):
+class InferenceError(Exception):
     """
-    Generate text using Hugging Face Inference API.
+    An inference call produced no usable output
     """
-    url = f"https://api-inference.huggingface.co/models/{model}"
-    headers = {"Authorization": f"Bearer {HF_TOKEN}"}
-    payload = {"inputs": prompt, "options": {"wait_for_model": True}}
-    response = requests.post(url, headers=headers, json=payload)
-    if response.status_code == 200:
-        try:
-            return response.json()[0]["generated_text"]
-        except:
-            return prompt
-    else:
-        st.warning(f"⚠️ HF text gen failed: {response.status_code}")
-        return prompt
 
 
-def hf_tts(text, model="tts_transformer", output_path="outputs/audio.wav"):
+@st.cache_resource
+def get_session():
     """
-    Generate TTS using Hugging Face.
+    Shared keep-alive session for inference calls (cached across reruns)
     """
-    url = f"https://api-inference.huggingface.co/models/{model}"
-    headers = {"Authorization": f"Bearer {HF_TOKEN}"}
+    session = requests.Session()
+    if INFERENCE_URL == HF_INFERENCE_URL:  # never send the HF token to other hosts
+        session.headers.update({"Authorization": f"Bearer {HF_TOKEN}"})
+    # Every inference call is a POST, which urllib3 does not retry by default.
+    # raise_on_status=False hands the last response back to the callers'
+    # status checks instead of raising once retries run out.
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                    allowed_methods=frozenset({"POST"}), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def hf_text_generation_stream(prompt, model, parameters=None):
+    """
+    Stream generated text from the Inference API, token by token (SSE).
+    Raises InferenceError if the request fails or the stream reports an error.
+    """
+    url = f"{INFERENCE_URL}/models/{model}"
+    headers = {"Accept": "text/event-stream"}
+    payload = {"inputs": prompt, "stream": True, "options": {"wait_for_model": True}}
+    if parameters:
+        payload["parameters"] = parameters
+    with get_session().post(url, headers=headers, json=payload, stream=True) as response:
+        if response.status_code != 200:
+            raise InferenceError(f"HF text gen failed: {response.status_code}")
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            # Models the API can't stream answer with plain JSON instead of SSE
+            try:
+                text = response.json()[0]["generated_text"]
+            except (ValueError, LookupError, TypeError):
+                raise InferenceError("HF text gen failed: unexpected response")
+            yield text
+            return
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if "error" in event:  # includes the local backend's stream timeout
+                raise InferenceError(f"HF text gen failed: {event['error']}")
+            token = event.get("token", {})
+            if not token.get("special"):
+                yield token.get("text", "")
+
+
+def hf_tts(text, model=TTS_MODEL, output_path="outputs/audio.wav"):
+    """
+    Generate TTS using the Inference API (local server.py or Hugging Face).
+    """
+    url = f"{INFERENCE_URL}/models/{model}"
     payload = {"inputs": text}
-    response = requests.post(url, headers=headers)
+    response = get_session().post(url, json=payload)
     if response.status_code == 200:
         with open(output_path, "wb") as f:
             f.write(response.content)
@@ -54,24 +126,151 @@ def hf_tts(text, model="tts_transformer", output_path="outputs/audio.wav"):
         return None
 
 
+# ---------------------- Local TTS ---------------------- #
+
+@st.cache_resource
+def load_voice():
+    """
+    Local Piper voice (ONNX), loaded once per process. None if unavailable.
+    """
+    try:
+        from piper import PiperVoice
+    except ImportError:
+        return None
+    if not os.path.exists(PIPER_VOICE):
+        return None
+    return PiperVoice.load(PIPER_VOICE)
+
+
+def piper_wav_bytes(text):
+    """
+    Synthesize speech offline with Piper, returned as in-memory WAV bytes
+    """
+    return voice_wav_bytes(load_voice(), text)
+
+
+def concat_wavs(chunks, output_path):
+    """
+    Join same-format WAV chunks (e.g. one per sentence) into one file
+    """
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as out:
+        for i, chunk in enumerate(chunks):
+            with wave.open(BytesIO(chunk), "rb") as wav:
+                if i == 0:
+                    out.setparams(wav.getparams())
+                out.writeframes(wav.readframes(wav.getnframes()))
+    write_atomic(output_path, buffer.getvalue())
+    return output_path
+
+
+def piper_tts(text, output_path="outputs/audio.wav"):
+    """
+    Synthesize speech offline with Piper
+    """
+    return concat_wavs([piper_wav_bytes(text)], output_path)
+
+
+def tts_story(text, output_path="outputs/audio.wav"):
+    """
+    Local Piper TTS when a voice is installed, the inference backend otherwise
+    """
+    if load_voice() is not None:
+        return piper_tts(text, output_path)
+    return hf_tts(text, output_path=output_path)
+
+
+# ---------------------- Cache Helpers ---------------------- #
+
+def cache_key(*parts):
+    """
+    Content-addressed key (sha256) for cached outputs
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    """
+    Write bytes via a uniquely named temp file and rename it into place, so
+    readers (and the exists() cache checks) never see a partial file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def cached_caption(image_bytes, image):
+    """
+    Caption cached on disk per (caption model, uploaded image bytes)
+    """
+    caption_path = os.path.join(CACHE_DIR, f"caption_{cache_key(CAPTION_MODEL, image_bytes)}.txt")
+    if os.path.exists(caption_path):
+        with open(caption_path, encoding="utf-8") as f:
+            return f.read()
+
+    caption = get_caption(image)
+    if caption != FALLBACK_CAPTION:  # don't cache the failure fallback
+        write_atomic(caption_path, caption.encode("utf-8"))
+    return caption
+
+
 # ---------------------- Image Helpers ---------------------- #
 
+def save_upload(image_bytes, image_path):
+    """
+    Persist the upload for ffmpeg (content-addressed, so written only once)
+    """
+    if not os.path.exists(image_path):
+        write_atomic(image_path, image_bytes)
+
+
+def load_drawing(image_bytes, max_size=512):
+    """
+    Decode the upload once, downsampled, for captioning and color analysis
+    """
+    img = Image.open(BytesIO(image_bytes))
+    img.draft("RGB", (max_size, max_size))  # JPEG: decode at reduced scale
+    img.thumbnail((max_size, max_size), Image.BILINEAR)
+    return img.convert("RGB")
+
+
 def get_caption(image: Image.Image):
     """
-    Simple caption placeholder (replace with HF model if you want real captions)
+    Caption the drawing with an image-to-text model (BLIP by default)
     """
-    return hf_text_generation("Describe this drawing: ")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG")
+    url = f"{INFERENCE_URL}/models/{CAPTION_MODEL}"
+    response = get_session().post(url, data=buffer.getvalue())
+    if response.status_code == 200:
+        try:
+            return response.json()[0]["generated_text"]
+        except:
+            return FALLBACK_CAPTION
+    else:
+        st.warning(f"⚠️ Captioning failed: {response.status_code}")
+        return FALLBACK_CAPTION
 
 
-def get_dominant_color(image_path):
+def get_dominant_color(image: Image.Image):
     """
-    Simple dominant color detection
+    Simple dominant color detection: median-cut to a small palette, then take
+    the palette entry covering the most pixels (the mode, not the mean)
     """
-    img = Image.open(image_path)
-    img = img.convert("RGB")
-    colors = img.getcolors(img.size[0]*img.size[1])
-    dominant_color = max(colors, key=lambda x: x[0])[1]
-    return dominant_color
+    img = image.resize((64, 64), Image.BILINEAR)
+    quantized = img.quantize(colors=8, method=Image.Quantize.MEDIANCUT)
+    _, index = max(quantized.getcolors())
+    palette = quantized.getpalette()
+    return tuple(palette[3 * index:3 * index + 3])
 
 
 def infer_emotion_from_color(color):
@@ -89,15 +288,74 @@ def infer_emotion_from_color(color):
         return "neutral"
 
 
-def generate_story(caption, emotion):
+def story_prompt(caption, emotion):
+    return f"Create a short children's story inspired by this caption: '{caption}' with emotion '{emotion}'"
+
+
+SENTENCE_END = re.compile(r"[.!?]\s")
+
+
+def stream_story(caption, emotion, placeholder, on_sentence=None):
+    """
+    Generate story text, rendering it into `placeholder` as tokens arrive.
+    Each completed sentence is passed to `on_sentence` while the rest of the
+    story is still generating. Stories are cached on disk per
+    (story model, caption, emotion). Raises InferenceError when no story
+    text comes back, so nothing empty is narrated or encoded.
+    """
+    story_path = os.path.join(CACHE_DIR, f"story_{cache_key(STORY_MODEL, caption, emotion)}.txt")
+    if os.path.exists(story_path):
+        with open(story_path, encoding="utf-8") as f:
+            return f.read()
+
+    prompt = story_prompt(caption, emotion)
+    story = ""
+    pending = ""
+    for token in hf_text_generation_stream(prompt, model=STORY_MODEL, parameters=STORY_PARAMETERS):
+        story += token
+        placeholder.markdown(story)
+        if on_sentence:
+            pending += token
+            match = SENTENCE_END.search(pending)
+            while match:
+                on_sentence(pending[:match.end()].strip())
+                pending = pending[match.end():]
+                match = SENTENCE_END.search(pending)
+    if on_sentence and pending.strip():
+        on_sentence(pending.strip())
+    if not story.strip():
+        raise InferenceError("the story model returned no text")
+    # Only reached when the stream completed: failures raise before this point
+    write_atomic(story_path, story.encode("utf-8"))
+    return story
+
+
+def cached_tts(story, sentence_audio=None):
+    """
+    TTS with the audio cached on disk per (voice, story text). `sentence_audio`
+    holds futures of per-sentence WAV chunks already synthesized during streaming.
+    """
+    voice = PIPER_VOICE if load_voice() is not None else TTS_MODEL
+    audio_path = os.path.join(CACHE_DIR, f"audio_{cache_key(voice, story)}.wav")
+    if os.path.exists(audio_path):
+        return audio_path
+    if sentence_audio:
+        return concat_wavs([future.result() for future in sentence_audio], audio_path)
+    return tts_story(story, output_path=audio_path)
+
+
+def tts_credit():
     """
-    Generate story text
+    Which TTS voiced the story, matching the choice made in tts_story
     """
-    prompt = f"Create a short children's story inspired by this caption: '{caption}' with emotion '{emotion}'"
-    return hf_text_generation(prompt)
+    if load_voice() is not None:
+        return "a local Piper voice"
+    if LOCAL_BACKEND:
+        return f"{TTS_MODEL} on the local inference backend"
+    return f"Hugging Face TTS ({TTS_MODEL})"
 
 
-def auto_generate_description(caption, emotion, story):
+def auto_generate_description(caption, emotion, story, voice):
     summary = story.strip().split("\n")[0]
     return f"""
 ✨ Dive into a magical tale born from a child’s imagination!
@@ -106,19 +364,93 @@ def auto_generate_description(caption, emotion, story):
 🎭 Emotion detected: {emotion.capitalize()}
 📖 Story Summary: {summary}
 
-🧒 Voice generated using Hugging Face TTS.
+🧒 Voice generated using {voice}.
 🎬 Video created with DreamCanvas+: GenAI-powered storytelling from kids' art.
 """.strip()
 
 
+# NVENC hardware encoder when a CUDA GPU is present, libx264 otherwise
+NVENC_ARGS = ["-c:v", "h264_nvenc", "-preset", "p4", "-tune", "ll", "-b:v", "2M"]
+X264_ARGS = ["-c:v", "libx264", "-tune", "stillimage", "-preset", "veryfast", "-threads", "2"]
+
+
+@st.cache_resource
+def ffmpeg_exe():
+    """
+    ffmpeg binary: IMAGEIO_FFMPEG_EXE if set, else a system ffmpeg (distro and
+    CUDA images usually build in NVENC; imageio-ffmpeg's static one does not),
+    else the imageio-ffmpeg bundled binary
+    """
+    return os.getenv("IMAGEIO_FFMPEG_EXE") or shutil.which("ffmpeg") or imageio_ffmpeg.get_ffmpeg_exe()
+
+
+@st.cache_resource
+def nvenc_state():
+    """
+    Whether NVENC is worth trying, per process. Starts as "the ffmpeg build
+    ships h264_nvenc" and is switched off after the first failed encode, so a
+    GPU-less host doesn't pay for a doomed NVENC pass on every video.
+    """
+    result = subprocess.run([ffmpeg_exe(), "-hide_banner", "-encoders"], capture_output=True, text=True)
+    return {"usable": "h264_nvenc" in result.stdout}
+
+
+def ffmpeg_video_cmd(image_path, audio_path, output_path, video_args):
+    return [
+        ffmpeg_exe(), "-y",
+        "-loop", "1", "-framerate", "2", "-i", image_path,
+        "-i", audio_path,
+        *video_args,
+        # yuv420p needs even dimensions
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+@st.cache_resource
+def get_encode_pool():
+    """
+    Bounded pool of ffmpeg workers shared by all sessions. Several 2-thread
+    encodes run side by side instead of users queueing on one ffmpeg.
+    """
+    return ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2),
+                              thread_name_prefix="ffmpeg")
+
+
 def generate_final_video(image_path, audio_path, output_path="outputs/final_video.mp4"):
     """
-    Generate a simple video from image + audio
+    Generate a simple video from image + audio (waits for a free encode worker).
+    Output paths are content-addressed, so an existing file is reused as is.
+    """
+    if os.path.exists(output_path):
+        return output_path
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".part.mp4")
+    os.close(fd)
+    try:
+        get_encode_pool().submit(encode_video, image_path, audio_path, tmp_path).result()
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return output_path
+
+
+def encode_video(image_path, audio_path, output_path):
+    """
+    Calls ffmpeg directly: the image is a still, so it is looped at a low
+    frame rate instead of piping 24 identical frames/s through MoviePy.
     """
-    audio_clip = AudioFileClip(audio_path)
-    image_clip = ImageClip(image_path).set_duration(audio_clip.duration)
-    image_clip = image_clip.set_audio(audio_clip)
-    image_clip.write_videofile(output_path, fps=24)
+    nvenc = nvenc_state()
+    if nvenc["usable"]:
+        try:
+            subprocess.run(ffmpeg_video_cmd(image_path, audio_path, output_path, NVENC_ARGS),
+                           check=True, capture_output=True)
+            return output_path
+        except subprocess.CalledProcessError:
+            nvenc["usable"] = False  # encoder compiled in but no usable GPU; use CPU from now on
+    subprocess.run(ffmpeg_video_cmd(image_path, audio_path, output_path, X264_ARGS),
+                   check=True, capture_output=True)
     return output_path
 
 
@@ -127,40 +459,58 @@ def generate_final_video(image_path, audio_path, output_path="outputs/final_vide
 uploaded = st.file_uploader("Upload your child's drawing", type=["jpg", "png", "jpeg"])
 
 if uploaded:
-    image_path = os.path.join("outputs", uploaded.name)
-    with open(image_path, "wb") as f:
-        f.write(uploaded.read())
-    st.image(image_path, caption="Drawing Uploaded", use_column_width=True)
+    image_bytes = uploaded.getvalue()
+    st.image(image_bytes, caption="Drawing Uploaded", use_column_width=True)
 
     if st.button("✨ Create Story Video"):
         try:
-            with st.spinner("🔍 Captioning drawing..."):
-                caption = get_caption(Image.open(image_path))
-
-            color = get_dominant_color(image_path)
+            # Color analysis and persisting the upload (only ffmpeg needs a
+            # file) are local and independent of the caption, so they run in
+            # the background while the caption request is in flight.
+            # The caption stays on the script thread since it may call st.*.
+            image_path = os.path.join(CACHE_DIR, f"drawing_{cache_key(image_bytes)}{os.path.splitext(uploaded.name)[1]}")
+            drawing = load_drawing(image_bytes)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                save_future = executor.submit(save_upload, image_bytes, image_path)
+                color_future = executor.submit(get_dominant_color, drawing)
+                with st.spinner("🔍 Captioning drawing..."):
+                    caption = cached_caption(image_bytes, drawing)
+                color = color_future.result()
+                save_future.result()  # surface write errors here, not as an ffmpeg failure
             emotion = infer_emotion_from_color(color)
 
             st.success(f"📝 Caption: {caption}")
             st.success(f"🎭 Emotion: {emotion}")
 
-            with st.spinner("🧠 Generating story..."):
-                story = generate_story(caption, emotion)
-                st.text_area("📖 Story", story, height=150)
-
-            with st.spinner("🎤 Generating voice..."):
-                audio_path = hf_tts(story)
-                if audio_path:
-                    st.audio(audio_path)
-                else:
-                    st.warning("⚠️ TTS failed. Video will be generated without audio.")
+            # With a local voice, narrate each sentence as soon as it is
+            # generated instead of waiting for the whole story.
+            sentence_audio = []
+            with ThreadPoolExecutor(max_workers=1) as tts_executor:
+                on_sentence = (
+                    (lambda sentence: sentence_audio.append(tts_executor.submit(piper_wav_bytes, sentence)))
+                    if load_voice() is not None else None
+                )
+
+                with st.spinner("🧠 Generating story..."):
+                    story_placeholder = st.empty()
+                    story = stream_story(caption, emotion, story_placeholder, on_sentence)
+                    story_placeholder.text_area("📖 Story", story, height=150)
+
+                with st.spinner("🎤 Generating voice..."):
+                    audio_path = cached_tts(story, sentence_audio)
+                    if audio_path:
+                        st.audio(audio_path)
+                    else:
+                        st.warning("⚠️ TTS failed. Video will be generated without audio.")
 
             if audio_path:
                 with st.spinner("🎞️ Generating video..."):
-                    final_video = generate_final_video(image_path, audio_path)
+                    video_path = os.path.join(CACHE_DIR, f"video_{cache_key(image_bytes, audio_path)}.mp4")
+                    final_video = generate_final_video(image_path, audio_path, video_path)
                     st.video(final_video)
 
                 with st.spinner("📝 Generating description..."):
-                    desc = auto_generate_description(caption, emotion, story)
+                    desc = auto_generate_description(caption, emotion, story, tts_credit())
                     st.text_area("📄 Video Description", desc, height=200)
 
                 # Download buttons
@@ -0,0 +1,128 @@
+# server.py
+
+# Local inference backend for DreamCanvas+: captioning, story generation and
+# TTS run in-process behind the same /models/{model_id} interface as the
+# Hugging Face Inference API, so app.py only needs INFERENCE_URL pointed here.
+#
+#   WEB_CONCURRENCY=2 uvicorn server:app --loop uvloop --http httptools
+
+import os
+import json
+from io import BytesIO
+from queue import Empty
+from threading import Thread
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+import torch
+from PIL import Image
+from transformers import pipeline, TextIteratorStreamer
+from dotenv import load_dotenv
+
+from tts_utils import voice_wav_bytes
+
+load_dotenv()
+CAPTION_MODEL = os.getenv("CAPTION_MODEL", "Salesforce/blip-image-captioning-base")
+STORY_MODEL = os.getenv("STORY_MODEL", "google/flan-t5-base")
+TTS_MODEL = os.getenv("TTS_MODEL", "piper")
+PIPER_VOICE = os.getenv("PIPER_VOICE", "en_US-amy-medium.onnx")
+STREAM_TIMEOUT = 60  # seconds to wait for the next token before giving up
+
+# fp16 on GPU halves the memory bandwidth decode is bound by; CPU stays fp32
+DEVICE = 0 if torch.cuda.is_available() else -1
+DTYPE = torch.float16 if torch.cuda.is_available() else torch.float32
+
+# uvicorn takes its worker count from WEB_CONCURRENCY; split the cores between
+# workers so N workers x N torch threads don't oversubscribe the CPU.
+torch.set_num_threads(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))
+
+models = {}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Load every model once per worker process, before serving requests.
+    TTS is optional: without piper or the voice file it is simply not served.
+    """
+    models[CAPTION_MODEL] = pipeline("image-to-text", model=CAPTION_MODEL, device=DEVICE, torch_dtype=DTYPE)
+    models[STORY_MODEL] = pipeline("text2text-generation", model=STORY_MODEL, device=DEVICE, torch_dtype=DTYPE)
+    try:
+        from piper import PiperVoice
+    except ImportError:
+        PiperVoice = None
+    if PiperVoice is not None and os.path.exists(PIPER_VOICE):
+        models[TTS_MODEL] = PiperVoice.load(PIPER_VOICE)
+    yield
+    models.clear()
+
+
+app = FastAPI(title="DreamCanvas+ inference", lifespan=lifespan)
+
+
+# ---------------------- Model Runners ---------------------- #
+
+def caption_image(image_bytes):
+    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    return models[CAPTION_MODEL](image)
+
+
+def generate_text(prompt, parameters):
+    return models[STORY_MODEL](prompt, **parameters)
+
+
+def stream_text(prompt, parameters):
+    """
+    Yield SSE frames in the Inference API's text-generation stream format
+    """
+    generator = models[STORY_MODEL]
+    streamer = TextIteratorStreamer(generator.tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                    timeout=STREAM_TIMEOUT)
+    inputs = generator.tokenizer(prompt, return_tensors="pt").to(generator.model.device)
+    errors = []
+
+    def generate():
+        # If generate() raises (e.g. a bad client parameter) the streamer
+        # would never get its end signal and the consumer would block.
+        try:
+            generator.model.generate(**inputs, **parameters, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    Thread(target=generate, daemon=True).start()
+    try:
+        for text in streamer:
+            if text:
+                yield f"data: {json.dumps({'token': {'text': text, 'special': False}})}\n\n"
+    except Empty:
+        errors.append(TimeoutError(f"no tokens generated for {STREAM_TIMEOUT}s"))
+    if errors:
+        yield f"data: {json.dumps({'error': str(errors[0])})}\n\n"
+
+
+def synthesize_speech(text):
+    return voice_wav_bytes(models[TTS_MODEL], text)
+
+
+# ---------------------- Routes ---------------------- #
+
+@app.post("/models/{model_id:path}")
+async def run_model(model_id: str, request: Request):
+    if model_id not in models:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} is not served here")
+
+    if model_id == CAPTION_MODEL:
+        return await run_in_threadpool(caption_image, await request.body())
+
+    payload = await request.json()
+    if model_id == TTS_MODEL:
+        audio = await run_in_threadpool(synthesize_speech, payload["inputs"])
+        return Response(audio, media_type="audio/wav")
+
+    parameters = payload.get("parameters", {})
+    if payload.get("stream"):
+        return StreamingResponse(stream_text(payload["inputs"], parameters), media_type="text/event-stream")
+    return await run_in_threadpool(generate_text, payload["inputs"], parameters)
@@ -0,0 +1,20 @@
+from PIL import Image
+
+from app import get_dominant_color, infer_emotion_from_color
+
+
+def two_colour_image(major, minor, major_share=0.6, size=(100, 100)):
+    image = Image.new("RGB", size, minor)
+    image.paste(major, (0, 0, int(size[0] * major_share), size[1]))
+    return image
+
+
+def test_dominant_color_is_the_majority_colour_not_the_mean():
+    image = two_colour_image((255, 0, 0), (0, 0, 255))
+    assert get_dominant_color(image) == (255, 0, 0)
+    assert infer_emotion_from_color(get_dominant_color(image)) == "excited"
+
+
+def test_dominant_color_ignores_a_minor_stripe():
+    image = two_colour_image((255, 255, 255), (0, 200, 0), major_share=0.8)
+    assert get_dominant_color(image) == (255, 255, 255)
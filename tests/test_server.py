@@ -0,0 +1,136 @@
+import io
+import json
+import time
+import wave
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import server
+
+WORDS = {1: "Once", 2: "upon", 3: "a", 4: "time."}
+
+
+class FakeTokenizer:
+    class Encoding(dict):
+        def to(self, device):
+            return self
+
+    def __call__(self, prompt, return_tensors=None):
+        return self.Encoding(input_ids=torch.tensor([[9, 9]]))
+
+    def decode(self, ids, **kwargs):
+        return " ".join(WORDS[i] for i in ids if i in WORDS) + " "
+
+
+class FakeModel:
+    device = "cpu"
+
+    def __init__(self, generate):
+        self._generate = generate
+
+    def generate(self, **kwargs):
+        self._generate(kwargs.pop("streamer"), kwargs)
+
+
+class FakeStoryPipeline:
+    tokenizer = FakeTokenizer()
+
+    def __init__(self, generate=None):
+        self.model = FakeModel(generate or self.emit_words)
+
+    @staticmethod
+    def emit_words(streamer, kwargs):
+        streamer.put(torch.tensor([0]))  # decoder start token, skipped as prompt
+        for token_id in WORDS:
+            streamer.put(torch.tensor([token_id]))
+        streamer.end()
+
+    def __call__(self, prompt, **parameters):
+        return [{"generated_text": f"story for: {prompt}"}]
+
+
+class FakeVoice:
+    def synthesize(self, text, wav_file):
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(b"\x00\x00" * 8)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Stub models instead of the lifespan loader; TestClient is not used as a
+    # context manager, so the real models are never downloaded.
+    monkeypatch.setattr(server, "models", {
+        server.CAPTION_MODEL: lambda image: [{"generated_text": f"a {image.size[0]}px drawing"}],
+        server.STORY_MODEL: FakeStoryPipeline(),
+        server.TTS_MODEL: FakeVoice(),
+    })
+    return TestClient(server.app)
+
+
+def sse_events(body):
+    return [json.loads(line[len("data:"):]) for line in body.splitlines() if line.startswith("data:")]
+
+
+def test_unknown_model_is_404(client):
+    response = client.post("/models/not/served", json={"inputs": "hi"})
+    assert response.status_code == 404
+
+
+def test_caption_response_shape(client):
+    image = io.BytesIO()
+    Image.new("RGB", (32, 16), "red").save(image, format="PNG")
+    response = client.post(f"/models/{server.CAPTION_MODEL}", content=image.getvalue())
+    assert response.status_code == 200
+    assert response.json() == [{"generated_text": "a 32px drawing"}]
+
+
+def test_generation_response_shape(client):
+    response = client.post(f"/models/{server.STORY_MODEL}", json={"inputs": "tell a story"})
+    assert response.status_code == 200
+    assert response.json() == [{"generated_text": "story for: tell a story"}]
+
+
+def test_tts_returns_wav(client):
+    response = client.post(f"/models/{server.TTS_MODEL}", json={"inputs": "hello"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/wav"
+    with wave.open(io.BytesIO(response.content), "rb") as wav:
+        assert wav.getnframes() == 8
+
+
+def test_stream_emits_token_frames(client):
+    response = client.post(f"/models/{server.STORY_MODEL}", json={"inputs": "tell a story", "stream": True})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response.text)
+    assert all("token" in event for event in events)
+    assert "".join(event["token"]["text"] for event in events).split() == ["Once", "upon", "a", "time."]
+
+
+def test_stream_ends_with_error_frame_when_generate_raises(client):
+    def broken(streamer, kwargs):
+        raise ValueError("bad parameter")
+
+    server.models[server.STORY_MODEL] = FakeStoryPipeline(broken)
+    response = client.post(f"/models/{server.STORY_MODEL}", json={"inputs": "x", "stream": True})
+    assert sse_events(response.text) == [{"error": "bad parameter"}]
+
+
+def test_stream_ends_with_error_frame_on_timeout(client, monkeypatch):
+    def stalled(streamer, kwargs):
+        time.sleep(1)
+
+    monkeypatch.setattr(server, "STREAM_TIMEOUT", 0.1)
+    server.models[server.STORY_MODEL] = FakeStoryPipeline(stalled)
+    response = client.post(f"/models/{server.STORY_MODEL}", json={"inputs": "x", "stream": True})
+    events = sse_events(response.text)
+    assert len(events) == 1 and "no tokens generated" in events[0]["error"]
@@ -0,0 +1,110 @@
+import wave
+from concurrent.futures import Future
+from io import BytesIO
+
+import pytest
+
+import app
+
+
+class FakePlaceholder:
+    def __init__(self):
+        self.renders = []
+
+    def markdown(self, text):
+        self.renders.append(text)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def fake_stream(tokens, calls=None):
+    def stream(prompt, model, parameters=None):
+        if calls is not None:
+            calls.append(prompt)
+        yield from tokens
+    return stream
+
+
+def wav_chunk(sample, frames=4):
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(bytes([sample, 0]) * frames)
+    return buffer.getvalue()
+
+
+def done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def test_sentences_split_across_tokens_and_trailing_text_is_flushed(cache_dir, monkeypatch):
+    tokens = ["Once upon", " a time. The", " cat sat! Did", " it nap? ", "The end"]
+    monkeypatch.setattr(app, "hf_text_generation_stream", fake_stream(tokens))
+    sentences = []
+    placeholder = FakePlaceholder()
+
+    story = app.stream_story("a cat", "happy", placeholder, sentences.append)
+
+    assert story == "".join(tokens)
+    assert sentences == ["Once upon a time.", "The cat sat!", "Did it nap?", "The end"]
+    assert placeholder.renders[-1] == story
+
+
+def test_story_cache_hit_skips_generation(cache_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "hf_text_generation_stream", fake_stream(["A story. "], calls))
+
+    first = app.stream_story("a cat", "happy", FakePlaceholder())
+    second = app.stream_story("a cat", "happy", FakePlaceholder())
+    app.stream_story("a dog", "happy", FakePlaceholder())
+
+    assert first == second == "A story. "
+    assert len(calls) == 2  # only the two distinct (caption, emotion) pairs
+
+
+def test_failed_stream_is_not_cached(cache_dir, monkeypatch):
+    def failing(prompt, model, parameters=None):
+        yield "Once upon a time. "
+        raise app.InferenceError("boom")
+
+    monkeypatch.setattr(app, "hf_text_generation_stream", failing)
+    with pytest.raises(app.InferenceError):
+        app.stream_story("a cat", "happy", FakePlaceholder())
+
+    monkeypatch.setattr(app, "hf_text_generation_stream", fake_stream([]))
+    with pytest.raises(app.InferenceError):
+        app.stream_story("a cat", "happy", FakePlaceholder())
+    assert not list(cache_dir.glob("story_*"))
+
+
+def test_concat_wavs_keeps_chunk_order(tmp_path):
+    output = app.concat_wavs([wav_chunk(1), wav_chunk(2), wav_chunk(3)], str(tmp_path / "out.wav"))
+
+    with wave.open(output, "rb") as wav:
+        assert wav.getnchannels() == 1 and wav.getframerate() == 16000
+        frames = wav.readframes(wav.getnframes())
+    assert frames == bytes([1, 0]) * 4 + bytes([2, 0]) * 4 + bytes([3, 0]) * 4
+    assert [p.name for p in tmp_path.iterdir()] == ["out.wav"]
+
+
+def test_cached_tts_joins_sentence_audio_then_hits_the_cache(cache_dir, monkeypatch):
+    monkeypatch.setattr(app, "load_voice", lambda: None)
+
+    def no_tts(*args, **kwargs):
+        raise AssertionError("full-story TTS should not run")
+
+    monkeypatch.setattr(app, "tts_story", no_tts)
+    audio_path = app.cached_tts("One. Two.", [done(wav_chunk(1)), done(wav_chunk(2))])
+
+    with wave.open(audio_path, "rb") as wav:
+        assert wav.readframes(wav.getnframes()) == bytes([1, 0]) * 4 + bytes([2, 0]) * 4
+    # Second call is a cache hit: no chunks, no TTS
+    assert app.cached_tts("One. Two.") == audio_path
@@ -0,0 +1,18 @@
+# tts_utils.py
+
+# Piper helpers shared by the Streamlit app and the local inference backend.
+
+import wave
+from io import BytesIO
+
+
+def voice_wav_bytes(voice, text):
+    """
+    Synthesize `text` with a loaded PiperVoice, returned as in-memory WAV bytes
+    """
+    # piper-tts >= 1.3 renamed synthesize(text, wav_file) to synthesize_wav
+    synthesize = getattr(voice, "synthesize_wav", voice.synthesize)
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        synthesize(text, wav_file)
+    return buffer.getvalue()